@@ -3,19 +3,45 @@
 # Python 3.8+ compatible
 
 import os
-from typing import Dict, List, Tuple
+from collections import deque
+from itertools import islice
+from typing import List, Tuple
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 
+try:
+    import polars as pl
+except ImportError:
+    # optional; large CSV imports fall back to pandas without it
+    pl = None
+
+try:
+    from numba import njit
+except ImportError:
+    # optional; history replay falls back to the python loop without it
+    njit = None
+
 st.set_page_config(page_title="Basketball Stat Clicker", layout="wide")
 
 # Box score columns requested
 EXPORT_COLUMNS = ["PTS", "REB", "AST", "2PM", "2PA", "3PM", "3PA", "STL", "BLK", "TOV"]
 
+# Stats are stored as one matrix (players x stats); PTS is computed.
+# int16 is plenty for per-game counts and halves the bytes hashed,
+# summed, and serialized per rerun.
+STAT_DTYPE = np.int16
+STAT_COLS = EXPORT_COLUMNS[1:]
+STAT_IDX = {k: i for i, k in enumerate(STAT_COLS)}
+
+# oldest undo entries are evicted past this, keeping session-state
+# serialization cost bounded over a long game
+MAX_HISTORY = 200
+
 # Buttons per player:
 # label, stat_key, delta, implies_attempt_key (make implies attempt)
-BUTTONS = [
+BUTTONS = (
     ("2PM",     "2PM", 1, "2PA"),
     ("2P Miss", "2PA", 1, None),
     ("3PM",     "3PM", 1, "3PA"),
@@ -25,7 +51,24 @@ BUTTONS = [
     ("STL",     "STL", 1, None),
     ("BLK",     "BLK", 1, None),
     ("TOV",     "TOV", 1, None),
-]
+)
+
+# built once so the box-score widget keeps an identical config across
+# reruns and Streamlit's per-widget diffing can minimize what it resends
+BOX_COLUMN_CONFIG = {
+    "PLAYER": st.column_config.TextColumn("PLAYER", pinned=True),
+    **{c: st.column_config.NumberColumn(c, format="%d") for c in EXPORT_COLUMNS},
+}
+
+# per-button stat column indices and deltas, so "make implies attempt"
+# is one fancy-indexed matrix update and one history entry
+BUTTON_CHANGES = tuple(
+    (
+        (STAT_IDX[key],) + ((STAT_IDX[implies],) if implies else ()),
+        (delta,) * (2 if implies else 1),
+    )
+    for _, key, delta, implies in BUTTONS
+)
 
 
 # -----------------------
@@ -33,72 +76,213 @@ BUTTONS = [
 # -----------------------
 def ensure_state() -> None:
     if "roster" not in st.session_state:
-        # roster = list of {"name": str, "stats": dict[str,int]}
+        # roster = list of player names; stats live in the matrix below
         st.session_state.roster = []
-    if "action_stack" not in st.session_state:
-        # action_stack = list of (player_index, [(stat_key, delta), ...])
-        st.session_state.action_stack = []
+    if "stats_base" not in st.session_state:
+        # the live matrix is derived, not stored: current_stats() folds
+        # history[:hist_idx] over this base snapshot, which only absorbs
+        # entries evicted from the bounded history or roster reshapes
+        st.session_state.stats_base = np.zeros((0, len(STAT_COLS)), dtype=STAT_DTYPE)
+    if "history" not in st.session_state:
+        # history = deque of (player_index, cols, deltas);
+        # hist_idx points just past the last applied entry, so entries at
+        # hist_idx and beyond are redoable
+        st.session_state.history = deque(maxlen=MAX_HISTORY)
+        st.session_state.hist_idx = 0
+    if "stats_version" not in st.session_state:
+        # bumped on every stat mutation; lets the main script tell whether
+        # the box score it last rendered is stale after fragment-only reruns
+        st.session_state.stats_version = 0
+
+
+def blank_stats() -> np.ndarray:
+    # one zeroed matrix row per player; PTS is computed
+    return np.zeros((1, len(STAT_COLS)), dtype=STAT_DTYPE)
+
+
+# PTS = 2*2PM + 3*3PM for every player in one dot product
+_PTS_COLS = [STAT_IDX["2PM"], STAT_IDX["3PM"]]
+_PTS_WEIGHTS = np.array([2, 3], dtype=np.int32)
+
+
+def pts_all(mat: np.ndarray) -> np.ndarray:
+    # widen before the product so int16 counts can't overflow PTS
+    return mat[:, _PTS_COLS].astype(np.int32) @ _PTS_WEIGHTS
+
+
+# every stat click mints a fresh key for the caches below (the key
+# embeds the stats bytes or history), so they must be bounded or each
+# click pins another entry in the process-wide cache forever; only the
+# latest few states are ever re-requested
+CACHE_MAX_ENTRIES = 64
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES)
+def _pts_all_cached(stats_bytes: bytes, n: int) -> Tuple[int, ...]:
+    mat = np.frombuffer(stats_bytes, dtype=STAT_DTYPE).reshape(n, len(STAT_COLS))
+    return tuple(int(v) for v in pts_all(mat))
+
+
+def player_points(i: int) -> int:
+    mat = current_stats()
+    return _pts_all_cached(mat.tobytes(), len(mat))[i]
+
 
+def _fold_entry(mat: np.ndarray, player_idx: int, cols: Tuple[int, ...], deltas: Tuple[int, ...]) -> None:
+    if player_idx < 0 or player_idx >= len(mat):
+        return
+    c = list(cols)
+    # one fancy-indexed update clamps every touched stat at zero at once
+    mat[player_idx, c] = np.maximum(
+        mat[player_idx, c] + np.asarray(deltas, dtype=mat.dtype), 0
+    )
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _fold_kernel(triples: np.ndarray, out: np.ndarray) -> None:
+        # tight compiled loop over (player, col, delta) rows with the
+        # same clamp-at-zero semantics as _fold_entry
+        for k in range(triples.shape[0]):
+            i = triples[k, 0]
+            if 0 <= i < out.shape[0]:
+                v = out[i, triples[k, 1]] + triples[k, 2]
+                out[i, triples[k, 1]] = v if v > 0 else 0
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES)
+def _fold_cached(base_bytes: bytes, entries: Tuple, n: int) -> np.ndarray:
+    mat = np.frombuffer(base_bytes, dtype=STAT_DTYPE).reshape(n, len(STAT_COLS)).copy()
+    if njit is not None and entries:
+        triples = np.array(
+            [(i, c, d) for i, cols, deltas in entries for c, d in zip(cols, deltas)],
+            dtype=np.int32,
+        )
+        _fold_kernel(triples, mat)
+    else:
+        for player_idx, cols, deltas in entries:
+            _fold_entry(mat, player_idx, cols, deltas)
+    return mat
+
+
+def current_stats() -> np.ndarray:
+    # fat state is never stored: the live matrix is the cached fold of
+    # the applied slice of the delta log over the base snapshot
+    entries = tuple(islice(st.session_state.history, st.session_state.hist_idx))
+    return _fold_cached(
+        st.session_state.stats_base.tobytes(), entries, len(st.session_state.roster)
+    )
 
-def blank_stats() -> Dict[str, int]:
-    # everything except PTS is stored; PTS is computed
-    return {k: 0 for k in EXPORT_COLUMNS if k != "PTS"}
 
+def add_player(name: str) -> None:
+    st.session_state.roster.append(name)
+    st.session_state.stats_base = np.vstack([st.session_state.stats_base, blank_stats()])
+    st.session_state.stats_version += 1
 
-def points(stats: Dict[str, int]) -> int:
-    return 2 * stats.get("2PM", 0) + 3 * stats.get("3PM", 0)
 
+def remove_player(player_idx: int) -> None:
+    # materialize the fold first so surviving players keep their stats,
+    # then restart the log against the new shape
+    mat = current_stats()
+    st.session_state.roster.pop(player_idx)
+    st.session_state.stats_base = np.delete(mat, player_idx, axis=0)
+    st.session_state.stats_version += 1
+    clear_history()
 
-def apply_change(player_idx: int, changes: List[Tuple[str, int]]) -> None:
-    p = st.session_state.roster[player_idx]
-    for key, delta in changes:
-        p["stats"][key] = max(0, int(p["stats"].get(key, 0)) + int(delta))
-    st.session_state.action_stack.append((player_idx, changes))
+
+def apply_change(player_idx: int, cols: Tuple[int, ...], deltas: Tuple[int, ...]) -> None:
+    hist = st.session_state.history
+    # a new action invalidates anything that was undone
+    while len(hist) > st.session_state.hist_idx:
+        hist.pop()
+    if len(hist) == MAX_HISTORY:
+        # evicted entries must keep contributing: fold the oldest into
+        # the base before it falls off; the cursor stays put since one
+        # entry leaves the log as one arrives
+        _fold_entry(st.session_state.stats_base, *hist.popleft())
+    else:
+        st.session_state.hist_idx += 1
+    hist.append((player_idx, cols, deltas))
+    st.session_state.stats_version += 1
 
 
 def undo_last() -> None:
-    if not st.session_state.action_stack:
+    if st.session_state.hist_idx == 0:
         st.toast("Nothing to undo.", icon="ℹ️")
         return
 
-    idx, changes = st.session_state.action_stack.pop()
-    if idx < 0 or idx >= len(st.session_state.roster):
+    st.session_state.hist_idx -= 1
+    st.session_state.stats_version += 1
+
+
+def redo_last() -> None:
+    if st.session_state.hist_idx >= len(st.session_state.history):
+        st.toast("Nothing to redo.", icon="ℹ️")
         return
 
-    p = st.session_state.roster[idx]
-    for key, delta in changes:
-        p["stats"][key] = max(0, int(p["stats"].get(key, 0)) - int(delta))
+    st.session_state.hist_idx += 1
+    st.session_state.stats_version += 1
 
 
-def build_df() -> pd.DataFrame:
-    rows = []
-    for p in st.session_state.roster:
-        s = p["stats"]
-        rows.append({
-            "PLAYER": p["name"],
-            "PTS": points(s),
-            "REB": s.get("REB", 0),
-            "AST": s.get("AST", 0),
-            "2PM": s.get("2PM", 0),
-            "2PA": s.get("2PA", 0),
-            "3PM": s.get("3PM", 0),
-            "3PA": s.get("3PA", 0),
-            "STL": s.get("STL", 0),
-            "BLK": s.get("BLK", 0),
-            "TOV": s.get("TOV", 0),
-        })
-
-    df = pd.DataFrame(rows, columns=["PLAYER"] + EXPORT_COLUMNS)
-
-    if len(df) > 0:
-        totals = {"PLAYER": "TOTALS"}
-        for col in EXPORT_COLUMNS:
-            totals[col] = int(df[col].sum())
-        df = pd.concat([df, pd.DataFrame([totals])], ignore_index=True)
+def clear_history() -> None:
+    st.session_state.history = deque(maxlen=MAX_HISTORY)
+    st.session_state.hist_idx = 0
+
+
+@st.cache_data
+def _player_headers(names: Tuple[str, ...]) -> Tuple[str, ...]:
+    # card headers only change when the roster does, not per click
+    return tuple(f"### {n}" for n in names)
+
+
+@st.cache_data
+def _button_keys(n_players: int) -> Tuple[Tuple[str, ...], ...]:
+    # widget keys only depend on player count, so the N x 9 f-strings
+    # are formatted once instead of on every card render
+    return tuple(
+        tuple(f"btn_{i}_{key}_{label}" for label, key, _, _ in BUTTONS)
+        for i in range(n_players)
+    )
+
+
+def roster_fingerprint() -> Tuple:
+    # cheap hashable snapshot of the roster; identical fingerprints mean
+    # identical stats, so cached results can be reused
+    return (tuple(st.session_state.roster), current_stats().tobytes())
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES)
+def _build_df_cached(names: Tuple[str, ...], stats_bytes: bytes) -> pd.DataFrame:
+    mat = np.frombuffer(stats_bytes, dtype=STAT_DTYPE).reshape(len(names), len(STAT_COLS))
+    if len(names) == 0:
+        return pd.DataFrame(columns=["PLAYER"] + EXPORT_COLUMNS)
 
+    # fill one preallocated array (players + TOTALS) instead of paying
+    # for column_stack and vstack copies
+    n = len(names)
+    full = np.empty((n + 1, len(EXPORT_COLUMNS)), dtype=np.int32)
+    full[:n, 0] = pts_all(mat)
+    full[:n, 1:] = mat
+    full[n] = full[:n].sum(axis=0)
+
+    df = pd.DataFrame(full, columns=EXPORT_COLUMNS)
+    df.insert(0, "PLAYER", list(names) + ["TOTALS"])
     return df
 
 
+def build_df() -> pd.DataFrame:
+    return _build_df_cached(*roster_fingerprint())
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES)
+def _csv_bytes_cached(names: Tuple[str, ...], stats_bytes: bytes) -> bytes:
+    return _build_df_cached(names, stats_bytes).to_csv(index=False).encode("utf-8")
+
+
+def build_csv_bytes() -> bytes:
+    return _csv_bytes_cached(*roster_fingerprint())
+
+
 def import_roster_from_df(df_in: pd.DataFrame) -> None:
     cols = [c.lower().strip() for c in df_in.columns]
     if "name" not in cols:
@@ -106,18 +290,57 @@ def import_roster_from_df(df_in: pd.DataFrame) -> None:
         return
 
     name_col = df_in.columns[cols.index("name")]
-    roster = []
-    for _, r in df_in.iterrows():
-        nm = str(r.get(name_col, "")).strip()
-        if nm:
-            roster.append({"name": nm, "stats": blank_stats()})
+    names = df_in[name_col].astype(str).str.strip()
+    roster = names[names != ""].tolist()
+
+    _set_imported_roster(roster)
 
+
+def _set_imported_roster(roster: List[str]) -> None:
     st.session_state.roster = roster
-    st.session_state.action_stack = []
+    st.session_state.stats_base = np.zeros((len(roster), len(STAT_COLS)), dtype=STAT_DTYPE)
+    st.session_state.stats_version += 1
+    clear_history()
     st.success(f"Imported {len(roster)} players.")
     st.rerun()
 
 
+@st.cache_data
+def load_roster_csv(path: str, mtime: float) -> List[str]:
+    # keyed on mtime so sessions share one parse and an edited file
+    # invalidates automatically
+    df = pd.read_csv(path, usecols=lambda c: c.lower().strip() == "name")
+    if df.shape[1] != 1:
+        return []
+    names = df.iloc[:, 0].astype(str).str.strip()
+    return names[names != ""].tolist()
+
+
+def import_roster_from_upload(up) -> None:
+    # stream the file in batches of just the name column so a huge (or
+    # mis-supplied) CSV never has to fit in memory at once
+    names = None
+    if pl is not None:
+        try:
+            reader = pl.read_csv_batched(up, columns=["name"], batch_size=50_000)
+            names = []
+            while True:
+                batches = reader.next_batches(4)
+                if not batches:
+                    break
+                for frame in batches:
+                    names.extend(n.strip() for n in frame["name"].to_list() if n and n.strip())
+        except Exception:
+            # polars couldn't handle the upload; retry with pandas
+            names = None
+            up.seek(0)
+
+    if names is None:
+        import_roster_from_df(pd.read_csv(up))
+    else:
+        _set_imported_roster(names)
+
+
 # -----------------------
 # App start
 # -----------------------
@@ -128,19 +351,15 @@ if "roster_loaded" not in st.session_state:
     st.session_state.roster_loaded = True
     if (not st.session_state.roster) and os.path.exists("roster.csv"):
         try:
-            df_auto = pd.read_csv("roster.csv")
-            cols = [c.lower().strip() for c in df_auto.columns]
-            if "name" in cols:
-                name_col = df_auto.columns[cols.index("name")]
-                auto_roster = []
-                for _, r in df_auto.iterrows():
-                    nm = str(r.get(name_col, "")).strip()
-                    if nm:
-                        auto_roster.append({"name": nm, "stats": blank_stats()})
-                st.session_state.roster = auto_roster
+            auto_roster = load_roster_csv("roster.csv", os.path.getmtime("roster.csv"))
         except Exception:
             # don't crash the app if roster.csv is malformed
-            pass
+            auto_roster = []
+        if auto_roster:
+            st.session_state.roster = auto_roster
+            st.session_state.stats_base = np.zeros(
+                (len(auto_roster), len(STAT_COLS)), dtype=STAT_DTYPE
+            )
 
 st.title("🏀 Basketball Stat Clicker (Streamlit) — All Players")
 
@@ -157,7 +376,7 @@ with st.sidebar:
             if not nm:
                 st.error("Please enter a player name.")
             else:
-                st.session_state.roster.append({"name": nm, "stats": blank_stats()})
+                add_player(nm)
                 st.session_state.add_name = ""
                 st.rerun()
 
@@ -166,27 +385,28 @@ with st.sidebar:
         up = st.file_uploader("Upload roster CSV", type=["csv"])
         if up is not None:
             try:
-                df_in = pd.read_csv(up)
-                import_roster_from_df(df_in)
+                import_roster_from_upload(up)
             except Exception as e:
                 st.error(f"Could not import CSV: {e}")
 
     with st.expander("Roster actions", expanded=False):
         if st.button("Reset all stats", use_container_width=True, disabled=(len(st.session_state.roster) == 0)):
-            for p in st.session_state.roster:
-                p["stats"] = blank_stats()
-            st.session_state.action_stack = []
+            st.session_state.stats_base = np.zeros_like(st.session_state.stats_base)
+            st.session_state.stats_version += 1
+            clear_history()
             st.rerun()
 
         if st.button("Clear roster", use_container_width=True, disabled=(len(st.session_state.roster) == 0)):
             st.session_state.roster = []
-            st.session_state.action_stack = []
+            st.session_state.stats_base = np.zeros((0, len(STAT_COLS)), dtype=STAT_DTYPE)
+            st.session_state.stats_version += 1
+            clear_history()
             st.rerun()
 
 # -----------------------
 # Top controls
 # -----------------------
-c1, c2 = st.columns([1, 2], gap="large")
+c1, c2 = st.columns(2, gap="large")
 
 with c1:
     if st.button("Undo last action", use_container_width=True, disabled=(len(st.session_state.roster) == 0)):
@@ -194,21 +414,71 @@ with c1:
         st.rerun()
 
 with c2:
-    csv_bytes = build_df().to_csv(index=False).encode("utf-8")
+    if st.button("Redo last action", use_container_width=True, disabled=(len(st.session_state.roster) == 0)):
+        redo_last()
+        st.rerun()
+
+st.divider()
+
+# -----------------------
+# Player panels
+# -----------------------
+@st.fragment
+def player_panel(i: int) -> None:
+    # clicks in here rerun only this player's card, not the whole script
+    st.markdown(_player_headers(tuple(st.session_state.roster))[i])
+    row = current_stats()[i]
+    st.caption(f"PTS: **{player_points(i)}**  •  REB: **{row[STAT_IDX['REB']]}**  •  AST: **{row[STAT_IDX['AST']]}**")
+
+    # Button grid: 3 columns of stat buttons per player
+    bcols = st.columns(3)
+    btn_keys = _button_keys(len(st.session_state.roster))[i]
+    for bi, (label, _, _, _) in enumerate(BUTTONS):
+        with bcols[bi % 3]:
+            # on_click runs before the rerun the click triggers, so the
+            # caption above renders fresh values without an explicit
+            # st.rerun — which would crash if the click were coalesced
+            # into a full script run
+            st.button(
+                label,
+                key=btn_keys[bi],
+                use_container_width=True,
+                on_click=apply_change,
+                args=(i,) + BUTTON_CHANGES[bi],
+            )
+
+    if st.button("Remove player", key=f"rm_{i}", use_container_width=True):
+        remove_player(i)
+        st.rerun()
+
+
+@st.fragment
+def box_score_panel() -> None:
+    # player cards only rerun their own fragment, so the table can lag
+    # behind; a click here reruns just this panel, and the version gate
+    # below refreshes the table and CSV in that same pass
+    st.subheader("Box score")
+    st.button("Refresh box score")
+    if st.session_state.get("box_version") != st.session_state.stats_version:
+        st.session_state.box_df = build_df()
+        st.session_state.box_csv = build_csv_bytes()
+        st.session_state.box_version = st.session_state.stats_version
+    st.dataframe(
+        st.session_state.box_df,
+        key="box",
+        column_config=BOX_COLUMN_CONFIG,
+        use_container_width=True,
+        hide_index=True,
+    )
     st.download_button(
         "Download stats CSV",
-        data=csv_bytes,
+        data=st.session_state.box_csv,
         file_name="game_stats.csv",
         mime="text/csv",
         use_container_width=True,
-        disabled=(len(st.session_state.roster) == 0),
     )
 
-st.divider()
 
-# -----------------------
-# Player panels
-# -----------------------
 if not st.session_state.roster:
     st.info("Add players in the sidebar or include roster.csv in the repo to auto-load.")
 else:
@@ -217,29 +487,9 @@ else:
     per_row = 2  # change to 3 if you want more compact on desktop
     cols = st.columns(per_row, gap="large")
 
-    for i, p in enumerate(st.session_state.roster):
+    for i in range(len(st.session_state.roster)):
         with cols[i % per_row]:
-            st.markdown(f"### {p['name']}")
-            s = p["stats"]
-            st.caption(f"PTS: **{points(s)}**  •  REB: **{s.get('REB',0)}**  •  AST: **{s.get('AST',0)}**")
-
-            # Button grid: 3 columns of stat buttons per player
-            bcols = st.columns(3)
-            for bi, (label, key, delta, implies) in enumerate(BUTTONS):
-                with bcols[bi % 3]:
-                    btn_key = f"btn_{i}_{key}_{label}"
-                    if st.button(label, key=btn_key, use_container_width=True):
-                        changes = [(key, delta)]
-                        if implies:
-                            changes.append((implies, delta))
-                        apply_change(i, changes)
-                        st.rerun()
-
-            if st.button("Remove player", key=f"rm_{i}", use_container_width=True):
-                st.session_state.roster.pop(i)
-                st.session_state.action_stack = []
-                st.rerun()
+            player_panel(i)
 
     st.divider()
-    st.subheader("Box score")
-    st.dataframe(build_df(), use_container_width=True, hide_index=True)
+    box_score_panel()